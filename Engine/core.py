@@ -1,11 +1,91 @@
 import os
+import sys
 import json
+import atexit
+import time
+import queue
 import logging
+import tempfile
+import threading
+import importlib.util
+from importlib.machinery import ModuleSpec
 from datetime import datetime
-from typing import Callable, Dict, List, Optional
+from operator import attrgetter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson est optionnel : repli sur la lib standard
+    orjson = None
+
+def dump_json(data: Any, indent: bool = True) -> bytes:
+    """Sérialise `data` en JSON (octets UTF-8), via orjson si disponible."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(data, indent=2).encode("utf-8")
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+def write_json_atomic(path: str, data: Any) -> None:
+    """Écrit `data` dans un fichier temporaire synchronisé sur disque puis le renomme : jamais de JSON tronqué."""
+    directory = os.path.dirname(path) or "."
+    payload = dump_json(data)
+    # Fichier temporaire unique : des écritures concurrentes ne se marchent pas dessus
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp crée le fichier en 0600 : on garde les droits du fichier remplacé
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    # Synchronise le dossier pour que le renommage lui-même survive à un crash
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def load_json(raw: bytes) -> Any:
+    """Désérialise un contenu JSON brut, via orjson si disponible."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+# Accesseurs utilisés pour sérialiser les utilisateurs colonne par colonne
+_get_id = attrgetter("id")
+_get_username = attrgetter("username")
+_get_metadata = attrgetter("metadata")
+_get_connected = attrgetter("connected")
+
+# Marqueur placé dans la file d'écriture pour demander un instantané
+_CHECKPOINT = object()
+
+_LOG_LEVELS: Dict[str, int] = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL,
+}
 
 class User:
     """Représente un utilisateur dans le moteur Italk."""
+    __slots__ = ("id", "username", "metadata", "connected")
+
     def __init__(self, user_id: str, username: str, metadata: Optional[dict] = None):
         self.id: str = user_id
         self.username: str = username
@@ -14,13 +94,21 @@ class User:
 
 class Message:
     """Message envoyé par un utilisateur."""
-    def __init__(self, user: 'User', content: str, timestamp: Optional[str] = None):
+    __slots__ = ("user", "content", "timestamp")
+
+    def __init__(self, user: 'User', content: str, timestamp: Optional[float] = None):
         self.user: User = user
         self.content: str = content
-        self.timestamp: str = timestamp or datetime.utcnow().isoformat()
+        self.timestamp: float = timestamp or time.time()
+
+    def iso_timestamp(self) -> str:
+        """Horodatage UTC au format ISO 8601, calculé seulement quand on le demande."""
+        return datetime.utcfromtimestamp(self.timestamp).isoformat()
 
 class Group:
     """Groupe d'utilisateurs."""
+    __slots__ = ("name", "members")
+
     def __init__(self, name: str):
         self.name: str = name
         self.members: Dict[str, User] = {}
@@ -37,26 +125,46 @@ class ItalkEngine:
         self.users: Dict[str, User] = {}
         self.groups: Dict[str, Group] = {}
         self.extensions: List[str] = []
-        self.listeners: Dict[str, List[Callable]] = {
-            "on_connect": [],
-            "on_disconnect": [],
-            "on_message": [],
-            "on_error": [],
+        self._extension_modules: Dict[str, Any] = {}
+        self._extension_specs: Dict[str, ModuleSpec] = {}
+        self._listeners_by_extension: Dict[str, List[Tuple[str, Callable]]] = {}   # {nom_extension: [(événement, callback)]}
+        # Tuples immuables : emit() lit un instantané stable sans verrou
+        self.listeners: Dict[str, Tuple[Callable, ...]] = {
+            "on_connect": (),
+            "on_disconnect": (),
+            "on_message": (),
+            "on_error": (),
         }
         self.config_path: str = config_path
         self.state_path: str = state_path
+        # Journal des opérations (WAL) rejoué au démarrage, vidé à chaque instantané
+        self.wal_path: str = os.path.splitext(state_path)[0] + ".wal"
+        self._wal_entries: int = 0
+        # Reste vrai tant qu'un instantané n'a pas réussi après une opération absente du journal
+        self._snapshot_needed: bool = False
+        # Rend atomiques « modifier l'état + journaliser » : l'ordre du journal suit celui de la mémoire
+        self._state_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._write_q: "queue.Queue[object]" = queue.Queue()
         self.load_config(self.config_path)
         self.setup_logging()
         self.load_extensions()
         self.load_state(self.state_path)
+        self._wal = open(self.wal_path, "ab", buffering=0)
+        if os.path.getsize(self.wal_path):
+            # Compacte le journal rejoué (et élimine une éventuelle ligne tronquée)
+            self.checkpoint()
+        self._writer = threading.Thread(target=self._writer_loop, name="ItalkEngine-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush_state)
 
     def load_config(self, path: str) -> None:
         if os.path.exists(path):
-            with open(path) as f:
-                self.config = json.load(f)
+            self.config = load_json(Path(path).read_bytes())
         else:
             self.config = {}
         self.logging_enabled = self.config.get("logging", True)
+        self.checkpoint_every: int = self.config.get("checkpoint_every", 1000)
 
     def setup_logging(self) -> None:
         self.logger = logging.getLogger("ItalkEngine")
@@ -67,125 +175,291 @@ class ItalkEngine:
             handler.setFormatter(formatter)
             self.logger.addHandler(handler)
 
-    def log(self, level: str, msg: str) -> None:
-        if self.logging_enabled:
-            log_func = getattr(self.logger, level.lower(), self.logger.info)
-            log_func(msg)
+    @property
+    def logger(self) -> logging.Logger:
+        return self._logger
+
+    @logger.setter
+    def logger(self, logger: logging.Logger) -> None:
+        # Les extensions peuvent remplacer engine.logger : la table des méthodes suit le nouveau logger
+        self._logger = logger
+        self._log_funcs: Dict[str, Callable] = {
+            name: getattr(logger, name, logger.info) for name in _LOG_LEVELS
+        }
+
+    def log(self, level: str, msg: str, *args: Any) -> None:
+        """Journalise `msg % args` ; le formatage n'a lieu que si le niveau est actif."""
+        if not self.logging_enabled or not self.logger.isEnabledFor(_LOG_LEVELS.get(level, logging.INFO)):
+            return
+        self._log_funcs.get(level, self.logger.info)(msg, *args)
 
     # --- Gestion des événements ---
     def on(self, event_name: str, callback: Callable) -> None:
         if event_name in self.listeners:
-            self.listeners[event_name].append(callback)
+            self.listeners[event_name] = self.listeners[event_name] + (callback,)
         else:
-            self.log("warning", f"Tentative d'ajouter un événement inconnu : {event_name}")
+            self.log("warning", "Tentative d'ajouter un événement inconnu : %s", event_name)
 
     def emit(self, event_name: str, *args, **kwargs) -> None:
-        for callback in self.listeners.get(event_name, []):
+        callbacks = self.listeners.get(event_name, ())
+        for callback in callbacks:
             try:
                 callback(*args, **kwargs)
             except Exception as e:
-                self.log("error", f"Erreur dans l'événement {event_name} : {e}")
+                self.log("error", "Erreur dans l'événement %s : %s", event_name, e)
 
     # --- Utilisateurs ---
     def register_user(self, user_id: str, username: str, metadata: Optional[dict] = None) -> User:
         """Crée un nouvel utilisateur."""
-        if user_id in self.users:
-            raise ValueError(f"Utilisateur {user_id} déjà enregistré")
-        user = User(user_id, username, metadata)
-        self.users[user_id] = user
-        self.save_state(self.state_path)
-        self.log("info", f"Utilisateur enregistré : {username}")
+        with self._state_lock:
+            if user_id in self.users:
+                raise ValueError(f"Utilisateur {user_id} déjà enregistré")
+            user = User(user_id, username, metadata)
+            self.users[user_id] = user
+            self._append_wal("register", id=user_id, username=username, metadata=user.metadata)
+        self.log("info", "Utilisateur enregistré : %s", username)
         return user
 
     def connect_user(self, user_id: str, username: str, metadata: Optional[dict] = None) -> User:
         """Connecte un utilisateur existant ou nouveau."""
-        user = self.users.get(user_id)
-        if not user:
-            user = User(user_id, username, metadata)
-            self.users[user_id] = user
-        user.connected = True
+        with self._state_lock:
+            user = self.users.get(user_id)
+            if not user:
+                user = User(user_id, username, metadata)
+                self.users[user_id] = user
+            elif user.connected:
+                # Déjà connecté : rien à émettre ni à journaliser
+                return user
+            user.connected = True
+            self._append_wal("connect", id=user_id, username=user.username, metadata=user.metadata)
+        # Les listeners sont appelés hors du verrou : ils peuvent rappeler le moteur
         self.emit("on_connect", user)
-        self.log("info", f"{username} connecté.")
-        self.save_state(self.state_path)
+        self.log("info", "%s connecté.", username)
         return user
 
     def disconnect_user(self, user_id: str) -> None:
-        user = self.users.get(user_id)
-        if user:
+        with self._state_lock:
+            user = self.users.get(user_id)
+            if not user or not user.connected:
+                return
             user.connected = False
-            self.emit("on_disconnect", user)
-            self.log("info", f"{user.username} déconnecté.")
-            self.save_state(self.state_path)
+            self._append_wal("disconnect", id=user_id)
+        self.emit("on_disconnect", user)
+        self.log("info", "%s déconnecté.", user.username)
 
     def send_message(self, user_id: str, content: str) -> Optional[Message]:
         user = self.users.get(user_id)
         if not user or not user.connected:
-            self.log("warning", f"Utilisateur non connecté : {user_id}")
+            self.log("warning", "Utilisateur non connecté : %s", user_id)
             return None
         msg = Message(user, content)
         self.emit("on_message", user, msg)
-        self.log("info", f"Message de {user.username} : {content}")
-        self.save_state(self.state_path)
+        self.log("info", "Message de %s : %s", user.username, content)
         return msg
 
     # --- Extensions ---
     def load_extensions(self) -> None:
         path = "extensions"
-        extensions_to_load = self.config.get("extensions", [])
         if not os.path.exists(path):
             os.mkdir(path)
-        for name in extensions_to_load:
-            file = f"{name}.py"
-            full_path = os.path.join(path, file)
-            if os.path.isfile(full_path):
+        for name in self.config.get("extensions", []):
+            self.activate_extension(name)
+
+    def activate_extension(self, name: str) -> bool:
+        """Charge une seule extension ; sans effet si elle est déjà chargée."""
+        if name in self.extensions:
+            return True
+        path = "extensions"
+        full_path = os.path.join(path, f"{name}.py")
+        if not os.path.isfile(full_path):
+            self.log("warning", "Extension %s non trouvée dans %s", name, path)
+            return False
+        before = dict(self.listeners)
+        try:
+            spec = self._extension_specs.get(name)
+            if spec is None:
+                spec = importlib.util.spec_from_file_location(f"extensions.{name}", full_path)
+                if not spec or not spec.loader:
+                    self.log("error", "Impossible de charger spec pour %s", name)
+                    return False
+                self._extension_specs[name] = spec
+            mod = importlib.util.module_from_spec(spec)
+            sys.modules[spec.name] = mod
+            spec.loader.exec_module(mod)
+            if hasattr(mod, "setup"):
+                mod.setup(self)
+                self.extensions.append(name)
+                self._extension_modules[name] = mod
+                self._listeners_by_extension[name] = self._listeners_added_since(before)
+                self.log("info", "Extension chargée : %s", name)
+                return True
+        except Exception as e:
+            sys.modules.pop(f"extensions.{name}", None)
+            # Un setup() interrompu ne doit pas laisser de callbacks derrière lui
+            self._remove_listeners(self._listeners_added_since(before))
+            self.log("error", "Erreur lors du chargement de l’extension %s : %s", name, e)
+        return False
+
+    def deactivate_extension(self, name: str) -> None:
+        """Décharge une extension, en appelant son `teardown(engine)` si elle en définit un."""
+        if name not in self.extensions:
+            return
+        self.extensions.remove(name)
+        mod = self._extension_modules.pop(name, None)
+        if mod is not None and hasattr(mod, "teardown"):
+            try:
+                mod.teardown(self)
+            except Exception as e:
+                self.log("error", "Erreur lors du déchargement de l’extension %s : %s", name, e)
+        # Retire les callbacks enregistrés via on() pendant le setup() de l'extension
+        self._remove_listeners(self._listeners_by_extension.pop(name, []))
+        sys.modules.pop(f"extensions.{name}", None)
+        self.log("info", "Extension déchargée : %s", name)
+
+    def _listeners_added_since(self, before: Dict[str, Tuple[Callable, ...]]) -> List[Tuple[str, Callable]]:
+        added = []
+        for event_name, callbacks in self.listeners.items():
+            previous = before.get(event_name, ())
+            added.extend((event_name, cb) for cb in callbacks if not any(cb is p for p in previous))
+        return added
+
+    def _remove_listeners(self, entries: List[Tuple[str, Callable]]) -> None:
+        for event_name, callback in entries:
+            self.listeners[event_name] = tuple(
+                cb for cb in self.listeners.get(event_name, ()) if cb is not callback
+            )
+
+    # --- Persistance ---
+    def _append_wal(self, op: str, **fields: Any) -> None:
+        """Met une opération en file pour le thread d'écriture ; l'appelant ne touche jamais au disque."""
+        self._write_q.put(dump_json({"op": op, "ts": time.time(), **fields}, indent=False) + b"\n")
+
+    def _writer_loop(self) -> None:
+        """Vide la file par lots : une écriture du journal par lot, plus un instantané si demandé ou si le journal est plein."""
+        while True:
+            items = [self._write_q.get()]
+            while True:
                 try:
-                    mod = __import__(f"extensions.{name}", fromlist=[name])
-                    if hasattr(mod, "setup"):
-                        mod.setup(self)
-                        self.extensions.append(name)
-                        self.log("info", f"Extension chargée : {name}")
-                except Exception as e:
-                    self.log("error", f"Erreur lors du chargement de l’extension {name} : {e}")
+                    items.append(self._write_q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                lines = [item for item in items if item is not _CHECKPOINT]
+                if lines:
+                    with self._write_lock:
+                        self._write_wal(b"".join(lines))
+                        self._wal_entries += len(lines)
+                if (len(lines) < len(items) or self._snapshot_needed
+                        or self._wal_entries >= self.checkpoint_every):
+                    self.checkpoint()
+            except Exception as e:
+                self.log("error", "Erreur lors de l’écriture du journal : %s", e)
+                # Les opérations absentes du journal ne sont rattrapées que par un instantané complet
+                self._snapshot_needed = True
+                self.mark_dirty()
+            finally:
+                for _ in items:
+                    self._write_q.task_done()
+
+    def _write_wal(self, data: bytes) -> None:
+        # FileIO.write peut écrire partiellement : on boucle jusqu'à tout avoir écrit
+        view = memoryview(data)
+        while view:
+            written = self._wal.write(view)
+            view = view[written:]
+
+    def _apply_wal_entry(self, entry: dict) -> None:
+        op = entry.get("op")
+        user = self.users.get(entry.get("id"))
+        if op in ("register", "connect"):
+            if not user:
+                user = User(entry["id"], entry["username"], entry.get("metadata", {}))
+                self.users[user.id] = user
+            if op == "connect":
+                user.connected = True
+        elif op == "disconnect" and user:
+            user.connected = False
+
+    def _replay_wal(self) -> None:
+        if not os.path.isfile(self.wal_path):
+            return
+        for raw in Path(self.wal_path).read_bytes().splitlines():
+            if not raw.strip():
+                continue
+            try:
+                self._apply_wal_entry(load_json(raw))
+            except Exception as e:
+                # Typiquement une dernière ligne tronquée par un arrêt brutal
+                self.log("warning", "Entrée du journal ignorée : %s", e)
+                continue
+            self._wal_entries += 1
+
+    def mark_dirty(self) -> None:
+        """Demande un instantané au thread d'écriture, après les opérations déjà en file."""
+        self._write_q.put(_CHECKPOINT)
+
+    def flush_state(self) -> None:
+        """Attend que la file soit vidée puis écrit un instantané s'il reste des opérations non consolidées."""
+        self._write_q.join()
+        if self._wal_entries or self._snapshot_needed:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """Écrit un instantané complet de l'état puis vide le journal."""
+        with self._write_lock:
+            if self._write_state_now(self.state_path):
+                self._wal.truncate(0)
+                self._wal_entries = 0
+                self._snapshot_needed = False
             else:
-                self.log("warning", f"Extension {name} non trouvée dans {path}")
+                self._snapshot_needed = True
 
-    # --- Persistance ---
-    def save_state(self, filepath: Optional[str] = None) -> None:
+    def _write_state_now(self, filepath: Optional[str] = None) -> bool:
         path = filepath or self.state_path
         try:
+            users = list(self.users.values())
             data = {
-                "users": [
-                    {"id": u.id, "username": u.username, "metadata": u.metadata, "connected": u.connected}
-                    for u in self.users.values()
-                ],
+                # Une colonne par attribut plutôt qu'un dict par utilisateur
+                "users": {
+                    "ids": list(map(_get_id, users)),
+                    "usernames": list(map(_get_username, users)),
+                    "metadata": list(map(_get_metadata, users)),
+                    "connected": list(map(_get_connected, users)),
+                },
                 "groups": [
                     {"name": g.name, "members": list(g.members.keys())}
-                    for g in self.groups.values()
+                    for g in list(self.groups.values())
                 ]
             }
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2)
+            write_json_atomic(path, data)
+            return True
         except Exception as e:
-            self.log("error", f"Erreur lors de la sauvegarde de l’état : {e}")
+            self.log("error", "Erreur lors de la sauvegarde de l’état : %s", e)
+            return False
 
     def load_state(self, filepath: Optional[str] = None) -> None:
         path = filepath or self.state_path
-        if not os.path.isfile(path):
-            return
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            self.users = {}
-            for u in data.get("users", []):
-                user = User(u["id"], u["username"], u.get("metadata", {}))
-                user.connected = u.get("connected", False)
-                self.users[user.id] = user
-            self.groups = {}
-            for g in data.get("groups", []):
-                group = Group(g["name"])
-                for user_id in g["members"]:
-                    if user_id in self.users:
-                        group.add_member(self.users[user_id])
-                self.groups[group.name] = group
-        except Exception as e:
-            self.log("error", f"Erreur lors du chargement de l’état : {e}")
+        if os.path.isfile(path):
+            try:
+                data = load_json(Path(path).read_bytes())
+                users = data.get("users", [])
+                if isinstance(users, dict):
+                    rows = zip(users["ids"], users["usernames"], users["metadata"], users["connected"])
+                else:  # ancien format : liste de dicts
+                    rows = ((u["id"], u["username"], u.get("metadata", {}), u.get("connected", False)) for u in users)
+                self.users = {}
+                for user_id, username, metadata, connected in rows:
+                    user = User(user_id, username, metadata)
+                    user.connected = connected
+                    self.users[user_id] = user
+                self.groups = {}
+                for g in data.get("groups", []):
+                    group = Group(g["name"])
+                    for user_id in g["members"]:
+                        if user_id in self.users:
+                            group.add_member(self.users[user_id])
+                    self.groups[group.name] = group
+            except Exception as e:
+                self.log("error", "Erreur lors du chargement de l’état : %s", e)
+        if path == self.state_path:
+            self._replay_wal()
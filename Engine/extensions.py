@@ -1,8 +1,26 @@
 import os
 import importlib.util
-import json
 import traceback
-from typing import Any, Callable, Dict, List, Optional
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from Engine.core import load_json
+
+def scan_extensions(folder: str, cache: Tuple[Optional[int], List[str]]) -> Tuple[Optional[int], List[str]]:
+    """
+    Retourne (mtime_ns du dossier, noms des extensions), en réutilisant `cache` si le dossier n'a pas changé.
+    Le résultat est un tuple neuf que l'appelant substitue en bloc à son cache.
+    """
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+    except FileNotFoundError:
+        return (None, [])
+    if cache[0] == mtime:
+        return cache
+    names = [
+        f[:-3] for f in os.listdir(folder)
+        if f.endswith(".py") and not f.startswith("_")
+    ]
+    return (mtime, names)
 
 class ExtensionManager:
     """
@@ -20,19 +38,26 @@ class ExtensionManager:
         self.extensions_folder = extensions_folder
         self.config_path = config_path
         self.logger = logger
+        self._log_funcs: Dict[str, Callable] = {
+            level: getattr(logger, level, logger.info)
+            for level in ('debug', 'info', 'warning', 'error', 'critical')
+        } if logger else {}
         self.extensions: Dict[str, Any] = {}   # {nom_extension: module}
-        self.hooks: Dict[str, List[Callable]] = {
-            'on_init': [],
-            'on_connect': [],
-            'on_disconnect': [],
-            'on_message': [],
-            'on_error': [],
+        self._hooks_by_extension: Dict[str, List[Tuple[str, Callable]]] = {}   # {nom_extension: [(hook, func)]}
+        self._available_cache: Tuple[Optional[int], List[str]] = (None, [])   # (mtime_ns du dossier, listing)
+        # Tuples reconstruits à chaque modification : call_hook() itère sur un instantané
+        self.hooks: Dict[str, Tuple[Callable, ...]] = {
+            'on_init': (),
+            'on_connect': (),
+            'on_disconnect': (),
+            'on_message': (),
+            'on_error': (),
         }
 
     # --- Logging interne ---
     def log(self, msg: str, level: str = "info") -> None:
         if self.logger:
-            getattr(self.logger, level, self.logger.info)(msg)
+            self._log_funcs.get(level, self.logger.info)(msg)
         else:
             print(f"[ExtensionManager] {level.upper()}: {msg}")
 
@@ -42,8 +67,7 @@ class ExtensionManager:
             self.log(f"Aucun fichier config trouvé ({self.config_path})", "warning")
             return []
         try:
-            with open(self.config_path, 'r', encoding='utf-8') as f:
-                cfg = json.load(f)
+            cfg = load_json(Path(self.config_path).read_bytes())
             return cfg.get('extensions', [])
         except Exception as e:
             self.log(f"Erreur chargement config extensions: {e}", "error")
@@ -75,7 +99,8 @@ class ExtensionManager:
             for hook in self.hooks.keys():
                 hook_func = getattr(module, hook, None)
                 if callable(hook_func):
-                    self.hooks[hook].append(hook_func)
+                    self.hooks[hook] = self.hooks[hook] + (hook_func,)
+                    self._hooks_by_extension.setdefault(name, []).append((hook, hook_func))
 
         except Exception:
             self.log(f"Erreur chargement extension {name}", "error")
@@ -86,9 +111,9 @@ class ExtensionManager:
         if not module:
             self.log(f"Extension non chargée : {name}", "warning")
             return
-        # Supprime tous les hooks liés à cette extension
-        for hook, funcs in self.hooks.items():
-            self.hooks[hook] = [f for f in funcs if f.__module__ != module.__name__]
+        # Supprime uniquement les hooks enregistrés par cette extension
+        for hook, hook_func in self._hooks_by_extension.pop(name, []):
+            self.hooks[hook] = tuple(f for f in self.hooks[hook] if f is not hook_func)
         del self.extensions[name]
         self.log(f"Extension déchargée : {name}")
 
@@ -98,10 +123,11 @@ class ExtensionManager:
 
     # --- Appel des hooks ---
     def call_hook(self, hook_name: str, *args, **kwargs) -> None:
-        if hook_name not in self.hooks:
+        funcs = self.hooks.get(hook_name)
+        if funcs is None:
             self.log(f"Hook inconnu: {hook_name}", "warning")
             return
-        for func in self.hooks[hook_name]:
+        for func in funcs:
             try:
                 func(self.engine, *args, **kwargs)
             except Exception:
@@ -110,9 +136,5 @@ class ExtensionManager:
 
     # --- Liste des extensions dispo ---
     def available_extensions(self) -> List[str]:
-        if not os.path.isdir(self.extensions_folder):
-            return []
-        return [
-            f[:-3] for f in os.listdir(self.extensions_folder)
-            if f.endswith(".py") and not f.startswith("_")
-        ]
+        self._available_cache = scan_extensions(self.extensions_folder, self._available_cache)
+        return self._available_cache[1]
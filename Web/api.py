@@ -1,13 +1,21 @@
 import os
-import json
+import time
 import datetime
+import threading
 import jwt
+import hmac
 import hashlib
 from functools import wraps
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHash, VerificationError
 from dotenv import load_dotenv
-from Engine.core import ItalkEngine
+from Engine.core import ItalkEngine, load_json, write_json_atomic
+from Engine.extensions import scan_extensions
+from Web.json_provider import install_json_provider
 
 # --- Chargement des variables d'environnement ---
 load_dotenv()
@@ -17,24 +25,123 @@ if not SECRET_KEY:
 
 # --- Initialisation ---
 app = Flask(__name__)
+install_json_provider(app)
 CORS(app)
 engine = ItalkEngine()  # instance du moteur partagé avec app.py
 
 USERS_FILE = "users.json"
+password_hasher = PasswordHasher()
+# Hash factice vérifié quand aucun hash argon2 réel n'est en jeu : le temps de réponse du login
+# ne révèle pas si le nom existe
+_DUMMY_PASSWORD_HASH = password_hasher.hash("italk-dummy-password")
+
+# Cache mémoire de users.json, invalidé par le mtime du fichier. Les index secondaires
+# (nom en minuscules / email -> user_id) sont remplacés en bloc avec les données, jamais modifiés sur place.
+_users_cache = {"mtime": 0, "data": None, "by_username_lower": {}, "by_email": {}, "lock": threading.Lock()}
+# Sérialise les modifications de users.json (vérification + écriture)
+_users_write_lock = threading.Lock()
+
+TOKEN_LIFETIME = datetime.timedelta(hours=2)
+TOKEN_REUSE_WINDOW = 60  # secondes pendant lesquelles /api/refresh renvoie le même jeton
+# Dernier jeton émis par utilisateur : {username: (token, exp_timestamp)}
+_token_cache: Dict[str, Tuple[str, float]] = {}
+_token_lock = threading.Lock()
+
+EXTENSIONS_DIR = "extensions"
+# Cache (mtime_ns, listing) du dossier des extensions, remplacé en bloc par scan_extensions
+_ext_dir_cache: Tuple[Optional[int], List[str]] = (None, [])
 
 # --- Fonctions utilitaires ---
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+    return password_hasher.hash(password)
+
+def is_legacy_hash(stored: str) -> bool:
+    return not stored.startswith("$argon2")
+
+def _dummy_verify(password: str) -> None:
+    try:
+        password_hasher.verify(_DUMMY_PASSWORD_HASH, password)
+    except (VerificationError, InvalidHash):
+        pass
+
+def verify_password(stored: str, password: str) -> bool:
+    """Vérifie un mot de passe (argon2, ou ancien hash SHA-256 hexadécimal)."""
+    if is_legacy_hash(stored):
+        _dummy_verify(password)  # même coût qu'une vérification argon2
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(stored, legacy)
+    try:
+        return password_hasher.verify(stored, password)
+    except (VerificationError, InvalidHash):
+        return False
+
+def _build_indexes(users) -> Tuple[Dict[str, str], Dict[str, str]]:
+    by_username_lower = {user["username"].lower(): user_id for user_id, user in users.items()}
+    by_email = {user["email"]: user_id for user_id, user in users.items()}
+    return by_username_lower, by_email
+
+def users_snapshot() -> Tuple[dict, Dict[str, str], Dict[str, str]]:
+    """Retourne (utilisateurs, index par nom en minuscules, index par email), cohérents entre eux.
+
+    users.json n'est relu que si son mtime a changé. Le snapshot ne doit pas être modifié :
+    passer une copie à save_users().
+    """
+    try:
+        mtime = os.stat(USERS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    with _users_cache["lock"]:
+        if _users_cache["data"] is None or _users_cache["mtime"] != mtime:
+            data = {} if mtime is None else load_json(Path(USERS_FILE).read_bytes())
+            _users_cache["by_username_lower"], _users_cache["by_email"] = _build_indexes(data)
+            _users_cache["data"] = data
+            _users_cache["mtime"] = mtime
+        return _users_cache["data"], _users_cache["by_username_lower"], _users_cache["by_email"]
 
 def load_users():
-    if not os.path.isfile(USERS_FILE):
-        return {}
-    with open(USERS_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return users_snapshot()[0]
 
 def save_users(users):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2)
+    """Écrit `users` sur disque puis seulement ensuite le publie dans le cache.
+
+    L'appelant doit tenir `_users_write_lock` ; l'écriture (et ses fsync) se fait hors du verrou
+    du cache pour ne pas bloquer les lectures de login/refresh.
+    """
+    by_username_lower, by_email = _build_indexes(users)
+    write_json_atomic(USERS_FILE, users)
+    mtime = os.stat(USERS_FILE).st_mtime_ns
+    with _users_cache["lock"]:
+        _users_cache["data"] = users
+        _users_cache["by_username_lower"] = by_username_lower
+        _users_cache["by_email"] = by_email
+        _users_cache["mtime"] = mtime
+
+def _registration_conflict(by_username_lower, by_email, username, email):
+    if username.lower() in by_username_lower:
+        return jsonify({"error": "Nom déjà utilisé"}), 409
+    if email in by_email:
+        return jsonify({"error": "Email déjà utilisé"}), 409
+    return None
+
+def issue_token(username: str) -> str:
+    """Encode un JWT pour `username`, en réutilisant celui émis il y a moins de TOKEN_REUSE_WINDOW secondes."""
+    now = time.time()
+    lifetime = TOKEN_LIFETIME.total_seconds()
+    with _token_lock:
+        token, exp = _token_cache.get(username, (None, 0))
+        if token and exp - now > lifetime - TOKEN_REUSE_WINDOW:
+            return token
+    exp = now + lifetime
+    token = jwt.encode({"user": username, "exp": int(exp)}, SECRET_KEY, algorithm="HS256")
+    with _token_lock:
+        _token_cache[username] = (token, exp)
+    return token
+
+def available_extensions():
+    """Liste les extensions du dossier, rescanné seulement si son mtime a changé."""
+    global _ext_dir_cache
+    _ext_dir_cache = scan_extensions(EXTENSIONS_DIR, _ext_dir_cache)
+    return _ext_dir_cache[1]
 
 def require_token(f):
     @wraps(f)
@@ -61,24 +168,30 @@ def register():
     email = data.get("email", "").strip().lower()
     password = data.get("password", "")
     confirm = data.get("confirm_password", "")
-    users = load_users()
 
     if not username or not email or not password or not confirm:
         return jsonify({"error": "Tous les champs sont obligatoires"}), 400
     if password != confirm:
         return jsonify({"error": "Mots de passe différents"}), 400
-    if any(u["username"].lower() == username.lower() for u in users.values()):
-        return jsonify({"error": "Nom déjà utilisé"}), 409
-    if any(u["email"] == email for u in users.values()):
-        return jsonify({"error": "Email déjà utilisé"}), 409
+    conflict = _registration_conflict(*users_snapshot()[1:], username, email)
+    if conflict:
+        return conflict
 
-    user_id = str(len(users) + 1)
-    users[user_id] = {
-        "username": username,
-        "email": email,
-        "password": hash_password(password)
-    }
-    save_users(users)
+    password_hash = hash_password(password)  # coûteux : hors du verrou
+    with _users_write_lock:
+        # Nouvelle vérification : un autre enregistrement a pu passer pendant le hachage
+        users, by_username_lower, by_email = users_snapshot()
+        conflict = _registration_conflict(by_username_lower, by_email, username, email)
+        if conflict:
+            return conflict
+        user_id = str(len(users) + 1)
+        new_users = dict(users)
+        new_users[user_id] = {
+            "username": username,
+            "email": email,
+            "password": password_hash
+        }
+        save_users(new_users)
     return jsonify({"status": "Utilisateur créé avec succès", "user_id": user_id})
 
 @app.route("/api/login", methods=["POST"])
@@ -86,35 +199,43 @@ def login():
     data = request.json or {}
     username = data.get("username", "").strip()
     password = data.get("password", "")
-    users = load_users()
 
     if not username or not password:
         return jsonify({"error": "Nom et mot de passe requis"}), 400
 
-    user = next((u for u in users.values() if u["username"].lower() == username.lower()), None)
-    if not user or user["password"] != hash_password(password):
+    users, by_username_lower, _ = users_snapshot()
+    user_id = by_username_lower.get(username.lower())
+    user = users.get(user_id)
+    if not user:
+        _dummy_verify(password)
+        return jsonify({"error": "Identifiants invalides"}), 403
+    if not verify_password(user["password"], password):
         return jsonify({"error": "Identifiants invalides"}), 403
+    if is_legacy_hash(user["password"]) or password_hasher.check_needs_rehash(user["password"]):
+        # Migration transparente des anciens hash vers argon2 ; un échec n'empêche pas la connexion
+        new_hash = hash_password(password)
+        try:
+            with _users_write_lock:
+                users = load_users()
+                if user_id in users:
+                    new_users = dict(users)
+                    new_users[user_id] = {**users[user_id], "password": new_hash}
+                    save_users(new_users)
+        except OSError as e:
+            engine.log("error", "Échec de la migration du mot de passe de %s : %s", user["username"], e)
 
-    payload = {
-        "user": user["username"],
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=2)
-    }
-    token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+    token = issue_token(user["username"])
     return jsonify({"token": token, "username": user["username"], "email": user["email"]})
 
 @app.route("/api/refresh", methods=["POST"])
 @require_token
 def refresh_token():
     username = request.user
-    users = load_users()
-    user = next((u for u in users.values() if u["username"] == username), None)
-    if not user:
+    users, by_username_lower, _ = users_snapshot()
+    user = users.get(by_username_lower.get(username.lower()))
+    if not user or user["username"] != username:
         return jsonify({"error": "Utilisateur introuvable"}), 404
-    payload = {
-        "user": user["username"],
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=2)
-    }
-    token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+    token = issue_token(user["username"])
     return jsonify({"token": token})
 
 # --- Routes ItalkEngine ---
@@ -156,7 +277,7 @@ def send_message():
         "message": {
             "user_id": user_id,
             "content": msg.content,
-            "timestamp": msg.timestamp
+            "timestamp": msg.iso_timestamp()
         }
     })
 
@@ -164,7 +285,7 @@ def send_message():
 @app.route("/api/extensions", methods=["GET"])
 @require_token
 def list_extensions():
-    available = [f[:-3] for f in os.listdir("extensions") if f.endswith(".py") and not f.startswith("_")]
+    available = available_extensions()
     loaded = engine.extensions
     return jsonify({"loaded": loaded, "available": available})
 
@@ -176,9 +297,8 @@ def activate_extension():
         return jsonify({"error": "No extension name"}), 400
     if ext not in engine.config.get("extensions", []):
         engine.config.setdefault("extensions", []).append(ext)
-        engine.load_extensions()
-        with open(engine.config_path, "w", encoding="utf-8") as f:
-            json.dump(engine.config, f, indent=2)
+        engine.activate_extension(ext)
+        write_json_atomic(engine.config_path, engine.config)
     return jsonify({"status": "ok"})
 
 @app.route("/api/extensions/deactivate", methods=["POST"])
@@ -188,9 +308,8 @@ def deactivate_extension():
     if not ext or ext not in engine.config.get("extensions", []):
         return jsonify({"error": "Extension non active"}), 400
     engine.config["extensions"].remove(ext)
-    engine.load_extensions()
-    with open(engine.config_path, "w", encoding="utf-8") as f:
-        json.dump(engine.config, f, indent=2)
+    engine.deactivate_extension(ext)
+    write_json_atomic(engine.config_path, engine.config)
     return jsonify({"status": "ok"})
 
 # --- Lancement ---
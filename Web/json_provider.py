@@ -0,0 +1,28 @@
+from typing import Any
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson est optionnel : Flask garde son fournisseur par défaut
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Fournisseur JSON Flask qui sérialise via orjson ; `jsonify` et `request.json` l'utilisent sans changement."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        # `self.default` conserve le rendu Flask des dates, UUID, dataclasses...
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+def install_json_provider(app: Flask) -> None:
+    """Remplace le fournisseur JSON de `app` par OrjsonProvider si orjson est installé."""
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
@@ -2,6 +2,7 @@ from flask import Flask, request, jsonify
 from flask_socketio import SocketIO, emit
 from Engine.core import ItalkEngine
 from Engine.extensions import ExtensionManager
+from Web.json_provider import install_json_provider
 from dotenv import load_dotenv
 import os
 
@@ -11,6 +12,7 @@ SECRET_KEY = os.getenv("SECRET_KEY", "default_secret")  # fallback si non défin
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
+install_json_provider(app)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 # --- Initialisation du moteur ---
@@ -26,12 +28,13 @@ def on_user_disconnected(user):
     socketio.emit('user_disconnected', {'id': user.id})
 
 def on_message(user, message):
-    print(f"[{message.timestamp}] {user.username} : {message.content}")
+    timestamp = message.iso_timestamp()
+    print(f"[{timestamp}] {user.username} : {message.content}")
     socketio.emit('new_message', {
         'user_id': user.id,
         'username': user.username,
         'content': message.content,
-        'timestamp': message.timestamp
+        'timestamp': timestamp
     })
 
 engine.on("on_connect", on_user_connected)